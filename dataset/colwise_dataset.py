@@ -6,7 +6,7 @@ import torch
 from tqdm import tqdm
 
 from config import Config
-from transformers import BertTokenizer, PreTrainedTokenizerBase
+from transformers import BertTokenizerFast, PreTrainedTokenizerBase
 
 from dataset.dataset import TableDataset
 
@@ -50,13 +50,12 @@ class ColWiseDataset(TableDataset):
             num_cols = len(table)
 
             # Tokenize table columns
-            tokenized_table_columns = table["column_data"].apply(
-                lambda x: tokenizer.encode(
-                    # max_length for SINGLE COLUMN. Not for table as sequence.
-                    # BERT maximum input length = 512. So, max_length = (512 // num_cols) - 2 (without special tokens)
-                    x, add_special_tokens=False, max_length=(512 // num_cols) - 2, truncation=True
-                )
-            ).tolist()
+            tokenized_table_columns = tokenizer(
+                table["column_data"].tolist(),
+                # max_length for SINGLE COLUMN. Not for table as sequence.
+                # BERT maximum input length = 512. So, max_length = (512 // num_cols) - 2 (without special tokens)
+                add_special_tokens=False, max_length=(512 // num_cols) - 2, truncation=True
+            )["input_ids"]
 
             labels = table["label_id"].values
             for i in range(num_cols):
@@ -88,7 +87,7 @@ if __name__ == "__main__":
 
     t = ColWiseDataset(
         data_dir="../" + config["dataset"]["data_dir"] + config["dataset"]["train_path"],
-        tokenizer=BertTokenizer.from_pretrained("bert-base-multilingual-uncased"),
+        tokenizer=BertTokenizerFast.from_pretrained("bert-base-multilingual-uncased"),
         num_rows=None,
     )
     print(t.df["data"].apply(lambda x: len(x)).max())
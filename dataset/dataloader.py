@@ -7,6 +7,7 @@ from torch.utils.data import DataLoader
 from torch.utils.data.sampler import SubsetRandomSampler
 
 from dataset.dataset import TableDataset
+from dataset.sampler import DistributedSubsetSampler, LengthBucketedBatchSampler
 
 
 class CtaDataLoader(DataLoader):
@@ -17,11 +18,25 @@ class CtaDataLoader(DataLoader):
 
     Shuffles given dataset and splits into train / validation subsets.
 
+    Note:
+        If `distributed` is set, train / validation subsets are sharded between processes of the distributed
+        group. Subsets are padded to be evenly divisible by the number of processes.
+
+        If `bucket_by_length` is set, every batch is drawn from samples of similar length,
+        which reduces padding of sequences in a batch.
+
     Args:
         dataset: dataset from which to load the data.
         batch_size: how many samples per batch to load.
         num_workers: how many subprocesses to use for data loading.
         collate_fn: merges a list of samples to form a mini-batch of Tensors.
+        pin_memory: copy batches into page-locked memory, enables asynchronous host to device copies.
+        persistent_workers: keep worker processes alive between epochs, used only if `num_workers` > 0.
+        prefetch_factor: number of batches loaded in advance by each worker, used only if `num_workers` > 0.
+        distributed: shard data between processes of the initialized distributed group.
+        bucket_by_length: group samples of similar length into batches.
+        num_buckets: number of length buckets, used only if `bucket_by_length` is set.
+        seed: random seed used to shuffle data in distributed / bucketed mode.
     """
     def __init__(
             self,
@@ -29,9 +44,21 @@ class CtaDataLoader(DataLoader):
             batch_size: int,
             split: Union[float, int] = 0.0,
             num_workers: Optional[int] = 0,
-            collate_fn: Optional[callable] = None
+            collate_fn: Optional[callable] = None,
+            pin_memory: bool = False,
+            persistent_workers: bool = False,
+            prefetch_factor: Optional[int] = None,
+            distributed: bool = False,
+            bucket_by_length: bool = False,
+            num_buckets: int = 16,
+            seed: int = 0
     ):
         self.split = split
+        self.distributed = distributed
+        self.bucket_batch_size = batch_size
+        self.num_buckets = num_buckets
+        self.seed = seed
+        self.lengths = dataset.df["data"].apply(len).to_numpy() if bucket_by_length else None
         self.num_samples = len(dataset)
         self.num_tables = dataset.df["table_id"].unique().shape[0]
         self.shuffle = False
@@ -39,25 +66,28 @@ class CtaDataLoader(DataLoader):
         dataset_ids = np.arange(self.num_samples)
         np.random.shuffle(dataset_ids)
         if split == 0.0:
-            self.train_sampler = SubsetRandomSampler(dataset_ids)
+            self.train_sampler = self._get_sampler(dataset_ids)
         else:
             self.train_sampler, self.valid_sampler = self._get_samplers(self.split, dataset_ids, dataset.df)
 
         self.init_kwargs = {
             'dataset': dataset,
-            'batch_size': batch_size,
-            'shuffle': self.shuffle,
             'collate_fn': collate_fn,
-            'num_workers': num_workers
+            'num_workers': num_workers,
+            'pin_memory': pin_memory
         }
-        super().__init__(sampler=self.train_sampler, **self.init_kwargs)
+        # Worker options are rejected by DataLoader, when data is loaded in the main process.
+        if num_workers:
+            self.init_kwargs['persistent_workers'] = persistent_workers
+            self.init_kwargs['prefetch_factor'] = prefetch_factor
+        super().__init__(**self._get_sampler_kwargs(self.train_sampler), **self.init_kwargs)
 
     def _get_samplers(
             self,
             split: Union[int, float],
             dataset_ids: np.ndarray,
             dataset: pandas.DataFrame
-    ) -> tuple[SubsetRandomSampler, SubsetRandomSampler]:
+    ) -> tuple[Union[SubsetRandomSampler, DistributedSubsetSampler, LengthBucketedBatchSampler], ...]:
         """Create train / valid samplers.
 
         Args:
@@ -84,13 +114,70 @@ class CtaDataLoader(DataLoader):
         # train_ids = np.delete(dataset_ids, np.arange(0, len_valid))
         self.num_samples = len(train_ids)
 
-        return SubsetRandomSampler(train_ids), SubsetRandomSampler(valid_ids)
+        return self._get_sampler(train_ids), self._get_sampler(valid_ids, shuffle=False)
+
+    def _get_sampler(
+            self,
+            ids: np.ndarray,
+            shuffle: bool = True
+    ) -> Union[SubsetRandomSampler, DistributedSubsetSampler, LengthBucketedBatchSampler]:
+        """Create sampler over dataset subset.
+
+        Args:
+            ids: Dataframe rows ids of the subset.
+            shuffle: Flag to shuffle subset in distributed / bucketed mode, otherwise subsets are always shuffled.
+
+        Returns:
+            Union[SubsetRandomSampler, DistributedSubsetSampler, LengthBucketedBatchSampler]: Random sampler,
+                sharded if `distributed` is set. Batch sampler, if `bucket_by_length` is set.
+        """
+        if self.lengths is not None:
+            return LengthBucketedBatchSampler(
+                ids,
+                self.lengths,
+                self.bucket_batch_size,
+                num_buckets=self.num_buckets,
+                shuffle=shuffle,
+                distributed=self.distributed,
+                seed=self.seed
+            )
+        if self.distributed:
+            return DistributedSubsetSampler(ids, shuffle=shuffle, seed=self.seed)
+        return SubsetRandomSampler(ids)
+
+    def _get_sampler_kwargs(
+            self,
+            sampler: Union[SubsetRandomSampler, DistributedSubsetSampler, LengthBucketedBatchSampler]
+    ) -> dict:
+        """Get DataLoader sampler arguments.
+
+        Args:
+            sampler: Sampler or batch sampler of the subset.
+
+        Returns:
+            dict: DataLoader keyword arguments, batch samplers exclude batch size and shuffle arguments.
+        """
+        if isinstance(sampler, LengthBucketedBatchSampler):
+            return {'batch_sampler': sampler}
+        return {'sampler': sampler, 'batch_size': self.bucket_batch_size, 'shuffle': self.shuffle}
 
     def get_valid_dataloader(self) -> DataLoader:
         """Create dataloader of validation split."""
         assert self.valid_sampler is not None
 
-        return DataLoader(sampler=self.valid_sampler, **self.init_kwargs)
+        return DataLoader(**self._get_sampler_kwargs(self.valid_sampler), **self.init_kwargs)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set epoch of the train sampler, reshuffles data in distributed / bucketed mode.
+
+        Args:
+            epoch: Epoch number.
+
+        Returns:
+            None
+        """
+        if hasattr(self.train_sampler, "set_epoch"):
+            self.train_sampler.set_epoch(epoch)
 
 
 if __name__ == "__main__":
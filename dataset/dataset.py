@@ -8,7 +8,7 @@ from torch.utils.data import Dataset
 import pandas as pd
 import glob
 
-from transformers import BertTokenizer, PreTrainedTokenizerBase
+from transformers import BertTokenizerFast, PreTrainedTokenizerBase
 
 from itertools import chain
 
@@ -55,6 +55,10 @@ class TableDataset(Dataset):
             df,
             tokenizer
         )
+        # Samples are accessed by index in lists, pandas row lookups are too slow for data loading.
+        self.data = self.df["data"].tolist()
+        self.labels = self.df["labels"].tolist()
+        self.table_ids = self.df["table_id"].tolist()
 
         self.transform = transform
         self.target_transform = target_transform
@@ -64,9 +68,9 @@ class TableDataset(Dataset):
 
     def __getitem__(self, idx):
         return {
-            "data": self.df.iloc[idx]["data"],
-            "labels": self.df.iloc[idx]["labels"],
-            "table_id": self.df.iloc[idx]["table_id"]
+            "data": self.data[idx],
+            "labels": self.labels[idx],
+            "table_id": self.table_ids[idx]
         }
 
     def read_multiple_csv(self, data_dir: str, num_rows: Optional[int] = None) -> pd.DataFrame:
@@ -115,6 +119,9 @@ class TableDataset(Dataset):
 
         [CLS] token_11 token_12 ... [SEP] [CLS] token_21 ... [SEP]
 
+        Note:
+            Columns of a table are tokenized in one batch, use fast (Rust-backed) tokenizer for speed.
+
         Args:
             df: Entire dataset as dataframe object.
             tokenizer: Pretrained BERT tokenizer.
@@ -128,13 +135,12 @@ class TableDataset(Dataset):
             num_cols = len(table)
 
             # Tokenize table columns.
-            tokenized_table_columns = table["column_data"].apply(
-                lambda x: tokenizer.encode(
-                    # max_length for SINGLE COLUMN. Not for table as sequence.
-                    # BERT maximum input length = 512. So, max_length = (512 // num_cols).
-                    x, add_special_tokens=True, max_length=(512 // num_cols), truncation=True
-                )
-            ).tolist()
+            tokenized_table_columns = tokenizer(
+                table["column_data"].tolist(),
+                # max_length for SINGLE COLUMN. Not for table as sequence.
+                # BERT maximum input length = 512. So, max_length = (512 // num_cols).
+                add_special_tokens=True, max_length=(512 // num_cols), truncation=True
+            )["input_ids"]
 
             # Concat table columns into one sequence.
             concat_tok_table_columns = list(chain.from_iterable(tokenized_table_columns))
@@ -159,7 +165,7 @@ if __name__ == "__main__":
 
     t = TableDataset(
         data_dir="../" + config["dataset"]["data_dir"] + config["dataset"]["train_path"],
-        tokenizer=BertTokenizer.from_pretrained("bert-base-multilingual-uncased"),
+        tokenizer=BertTokenizerFast.from_pretrained("bert-base-multilingual-uncased"),
         num_rows=100,
     )
     print(t.df["data"].apply(lambda x: len(x)).max())
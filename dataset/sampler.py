@@ -0,0 +1,111 @@
+import math
+
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data import Sampler
+from torch.utils.data.distributed import DistributedSampler
+
+
+class DistributedSubsetSampler(DistributedSampler):
+    """Distributed sampler over a subset of dataset indices.
+
+    Shards given dataset indices between processes of the distributed group, so every
+    process iterates over its own part of the subset.
+
+    Note:
+        Call `set_epoch` at the start of every epoch to reshuffle indices between epochs.
+
+    Args:
+        indices: dataset indices to sample from.
+        shuffle: if True, sampler will shuffle the indices.
+        seed: random seed used to shuffle indices, must be identical across all processes.
+    """
+    def __init__(self, indices: np.ndarray, shuffle: bool = True, seed: int = 0):
+        # DistributedSampler only requires the length of the dataset, so indices are sharded by position.
+        super().__init__(indices, shuffle=shuffle, seed=seed)
+        self.indices = indices
+
+    def __iter__(self):
+        return (int(self.indices[i]) for i in super().__iter__())
+
+
+class LengthBucketedBatchSampler(Sampler[list[int]]):
+    """Batch sampler, grouping samples of similar length.
+
+    Sorts given dataset indices by sequence length and splits them into buckets. Every batch is drawn
+    from a single bucket, so batches are padded to a similar length. Indices are shuffled within buckets
+    and batches are shuffled between buckets.
+
+    Note:
+        Call `set_epoch` at the start of every epoch to reshuffle batches between epochs.
+        In distributed mode batches are sharded between processes of the distributed group and padded
+        to be evenly divisible by the number of processes.
+
+    Args:
+        indices: dataset indices to sample from.
+        lengths: sequence lengths of all dataset samples, indexed by dataset index.
+        batch_size: how many samples per batch to load.
+        num_buckets: number of length buckets.
+        shuffle: if True, sampler will shuffle batches.
+        distributed: shard batches between processes of the initialized distributed group.
+        seed: random seed used to shuffle batches, must be identical across all processes.
+    """
+    def __init__(
+            self,
+            indices: np.ndarray,
+            lengths: np.ndarray,
+            batch_size: int,
+            num_buckets: int = 16,
+            shuffle: bool = True,
+            distributed: bool = False,
+            seed: int = 0
+    ):
+        super().__init__()
+        # Stable sort keeps sampling deterministic for equal lengths.
+        sorted_indices = indices[np.argsort(lengths[indices], kind="stable")]
+        self.buckets = [bucket for bucket in np.array_split(sorted_indices, num_buckets) if len(bucket)]
+
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        self.num_replicas, self.rank = 1, 0
+        if distributed:
+            self.num_replicas, self.rank = dist.get_world_size(), dist.get_rank()
+
+        num_batches = sum(math.ceil(len(bucket) / batch_size) for bucket in self.buckets)
+        self.num_batches = math.ceil(num_batches / self.num_replicas)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+
+        batches = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = rng.permutation(bucket)
+            batches.extend(
+                bucket[i:i + self.batch_size].tolist() for i in range(0, len(bucket), self.batch_size)
+            )
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        # Every process must get the same number of batches.
+        total_size = self.num_batches * self.num_replicas
+        padding_size = total_size - len(batches)
+        batches += (batches * math.ceil(padding_size / len(batches)))[:padding_size]
+        return iter(batches[self.rank:total_size:self.num_replicas])
+
+    def __len__(self) -> int:
+        return self.num_batches
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set epoch of the sampler, used as a part of shuffling seed.
+
+        Args:
+            epoch: Epoch number.
+
+        Returns:
+            None
+        """
+        self.epoch = epoch
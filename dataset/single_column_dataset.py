@@ -5,7 +5,7 @@ import torch
 from tqdm import tqdm
 
 from config import Config
-from transformers import BertTokenizer, PreTrainedTokenizerBase
+from transformers import BertTokenizerFast, PreTrainedTokenizerBase
 
 from dataset.dataset import TableDataset
 
@@ -51,11 +51,9 @@ class SingleColumnDataset(TableDataset):
         for table_id, table in tqdm(df.groupby("table_id")):
             num_cols = len(table)
 
-            tokenized_table_columns = table["column_data"].apply(
-                lambda x: tokenizer.encode(
-                    x, add_special_tokens=True, max_length=512, truncation=True
-                )
-            ).tolist()
+            tokenized_table_columns = tokenizer(
+                table["column_data"].tolist(), add_special_tokens=True, max_length=512, truncation=True
+            )["input_ids"]
 
             labels = table["label_id"].values
             for i in range(num_cols):
@@ -76,7 +74,7 @@ if __name__ == "__main__":
 
     t = SingleColumnDataset(
         data_dir="../" + config["dataset"]["data_dir"] + config["dataset"]["train_path"],
-        tokenizer=BertTokenizer.from_pretrained("bert-base-multilingual-uncased"),
+        tokenizer=BertTokenizerFast.from_pretrained("bert-base-multilingual-uncased"),
         num_rows=None,
     )
     print(t.df["data"].apply(lambda x: len(x)).max())
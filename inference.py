@@ -3,7 +3,7 @@ from pathlib import Path
 import pandas as pd
 import torch
 
-from transformers import BertTokenizer, BertConfig
+from transformers import BertTokenizerFast, BertConfig
 
 from config import Config
 from model.model import BertForClassification
@@ -22,7 +22,7 @@ class Inferencer:
         self.config = Config(config_path="config.json")
         self.directory = self.config["inference_dir"]
 
-        self.tokenizer = BertTokenizer.from_pretrained(self.config["pretrained_model_name"])
+        self.tokenizer = BertTokenizerFast.from_pretrained(self.config["pretrained_model_name"])
 
         dataset_type = get_dataset_type(self.config["table_serialization_type"])
 
@@ -78,7 +78,7 @@ class Inferencer:
             pd.DataFrame: Contains `table_id` and labels.
         """
 
-        set_rs(self.config["random_seed"])
+        set_rs(self.config["random_seed"], self.config["deterministic"])
 
         result_df = []
         self.model.eval()
@@ -88,11 +88,11 @@ class Inferencer:
                 data = sample["data"].to(self.device)
 
                 seq = data.unsqueeze(0)
-                attention_mask = torch.clone(seq != 0)
+                attention_mask = (seq != 0)
                 probs = self.model(seq, attention_mask=attention_mask)
                 if isinstance(probs, tuple):
                     probs = probs[0]
-                cls_probs = get_token_logits(self.device, seq, probs, self.tokenizer.cls_token_id)
+                cls_probs = get_token_logits(seq, probs, self.tokenizer.cls_token_id)
 
                 logits.append(cls_probs.argmax(1).cpu().detach().numpy().tolist())
 
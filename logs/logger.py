@@ -11,9 +11,11 @@ class Logger:
 
     Args:
         filename: Filename of the log file.
+        enabled: Flag to write messages, disabled loggers are used by non-main distributed processes.
     """
-    def __init__(self, filename: str = "train.log"):
+    def __init__(self, filename: str = "train.log", enabled: bool = True):
         self.filename = filename
+        self.enabled = enabled
 
     @staticmethod
     def nvidia_smi() -> None:
@@ -79,6 +81,8 @@ class Logger:
         Returns:
             None
         """
+        if not self.enabled:
+            return
         msg = f"{datetime.now():%d/%m/%y %H:%M:%S} [{tag}] [{level}] {msg}\n"
         with open(self.filename, mode="a") as f:
             f.write(msg)
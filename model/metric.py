@@ -1,50 +1,134 @@
-import itertools
+from typing import Optional
 
 import torch
-from torcheval.metrics.functional import multiclass_f1_score
+import torch.distributed as dist
 
 
-def multiple_f1_score(output: list, target: list, num_classes: int) -> dict:
-    """Calculate multiple F1 scores.
+def confusion_matrix(output: torch.Tensor, target: torch.Tensor, num_classes: int) -> torch.Tensor:
+    """Calculate confusion matrix.
 
-    For given outputs and targets calculate F1-micro, F1-macro and F1-weighted.
+    Note:
+        Matrix is accumulated with `index_add_`, which does not synchronize host with device
+        (unlike `torch.bincount`, that checks input range on host).
 
     Args:
-        output: List of outputs.
-        target: List of targets.
+        output: Tensor of predicted class indexes.
+        target: Tensor of target class indexes.
         num_classes: Number of classes, used for classification task.
 
+    Returns:
+        torch.Tensor: Confusion matrix (num_classes, num_classes), rows are targets and columns are predictions.
+    """
+    matrix = torch.zeros(num_classes * num_classes, dtype=torch.long, device=target.device)
+    matrix.index_add_(0, target * num_classes + output, torch.ones_like(target))
+    return matrix.view(num_classes, num_classes)
+
+
+def f1_scores_from_confusion_matrix(matrix: torch.Tensor) -> dict:
+    """Calculate multiple F1 scores from confusion matrix.
+
+    Note:
+        Classes without both targets and predictions are ignored by F1-macro and F1-weighted,
+        undefined per class F1 scores are set to zero.
+
+    Args:
+        matrix: Confusion matrix, rows are targets and columns are predictions.
+
     Returns:
         dict: Dictionary of calculated F1 scores (macro, micro, weighted).
     """
+    matrix = matrix.double()
+    num_tp = matrix.diag()
+    num_label = matrix.sum(1)
+    num_prediction = matrix.sum(0)
+
+    # For single label classification F1-micro equals accuracy.
+    f1_micro = num_tp.sum() / num_label.sum()
 
-    output = list(itertools.chain.from_iterable(output))
-    target = list(itertools.chain.from_iterable(target))
-
-    # TODO: memory cpy here, may be bad.
-    logits_tensor = torch.tensor(output)
-    targets_tensor = torch.tensor(target)
-    f1_micro = multiclass_f1_score(
-        logits_tensor,
-        targets_tensor,
-        num_classes=num_classes,
-        average="micro"
-    )
-    f1_macro = multiclass_f1_score(
-        logits_tensor,
-        targets_tensor,
-        num_classes=num_classes,
-        average="macro"
-    )
-    f1_weighted = multiclass_f1_score(
-        logits_tensor,
-        targets_tensor,
-        num_classes=num_classes,
-        average="weighted"
-    )
+    mask = (num_label != 0) | (num_prediction != 0)
+    num_tp, num_label, num_prediction = num_tp[mask], num_label[mask], num_prediction[mask]
+    f1 = torch.nan_to_num(2 * num_tp / (num_label + num_prediction), nan=0.0)
+
+    f1_macro = f1.mean()
+    f1_weighted = (f1 * num_label / num_label.sum()).sum()
 
     return {
-        "f1_micro": f1_micro,
-        "f1_macro": f1_macro,
-        "f1_weighted": f1_weighted
+        "f1_micro": torch.nan_to_num(f1_micro, nan=0.0).item(),
+        "f1_macro": torch.nan_to_num(f1_macro, nan=0.0).item(),
+        "f1_weighted": torch.nan_to_num(f1_weighted, nan=0.0).item()
     }
+
+
+def multiple_f1_score(output: torch.Tensor, target: torch.Tensor, num_classes: int) -> dict:
+    """Calculate multiple F1 scores.
+
+    For given outputs and targets calculate F1-micro, F1-macro and F1-weighted.
+
+    Note:
+        Tensors are processed on their own device, no host copies are made.
+        All scores are derived from a single confusion matrix.
+
+    Args:
+        output: Tensor of predicted class indexes.
+        target: Tensor of target class indexes.
+        num_classes: Number of classes, used for classification task.
+
+    Returns:
+        dict: Dictionary of calculated F1 scores (macro, micro, weighted).
+    """
+    return f1_scores_from_confusion_matrix(confusion_matrix(output, target, num_classes))
+
+
+class MultipleF1Score:
+    """Stateful multiple F1 scores.
+
+    Accumulates confusion matrix by batch on device and calculates F1-micro, F1-macro and F1-weighted
+    once at the end.
+
+    Note:
+        In distributed mode confusion matrices are summed between all processes on compute.
+
+    Args:
+        num_classes: Number of classes, used for classification task.
+        device: Device to store confusion matrix on.
+    """
+    def __init__(self, num_classes: int, device: Optional[torch.device] = None):
+        self.num_classes = num_classes
+        self.matrix = torch.zeros(num_classes, num_classes, dtype=torch.long, device=device)
+
+    def update(self, output: torch.Tensor, target: torch.Tensor) -> None:
+        """Update confusion matrix with batch.
+
+        Args:
+            output: Tensor of predicted class indexes.
+            target: Tensor of target class indexes.
+
+        Returns:
+            None
+        """
+        # Accumulate in place, the view shares memory with the matrix.
+        self.matrix.view(-1).index_add_(0, target * self.num_classes + output, torch.ones_like(target))
+
+    def compute(self) -> dict:
+        """Calculate F1 scores from accumulated confusion matrix.
+
+        Returns:
+            dict: Dictionary of calculated F1 scores (macro, micro, weighted).
+        """
+        matrix = self.matrix.clone()
+        if dist.is_initialized():
+            dist.all_reduce(matrix)
+        return f1_scores_from_confusion_matrix(matrix)
+
+    def reset(self) -> None:
+        """Reset accumulated confusion matrix.
+
+        Returns:
+            None
+        """
+        self.matrix.zero_()
+
+
+if __name__ == "__main__":
+    scores = multiple_f1_score(torch.tensor([0, 1, 1, 0]), torch.tensor([0, 0, 1, 2]), num_classes=4)
+    print(scores)
@@ -10,7 +10,7 @@ from logs.logger import Logger
 from model.metric import multiple_f1_score
 from model.model import BertForClassification
 
-from transformers import BertTokenizer, BertConfig
+from transformers import BertTokenizerFast, BertConfig
 
 from utils.functions import collate, prepare_device, get_token_logits, set_rs, get_map_location, \
     filter_model_state_dict, get_dataset_type
@@ -27,39 +27,39 @@ def stat(
         batch_size,
         num_labels
 ):
-    set_rs(config["random_seed"])
+    set_rs(config["random_seed"], config["deterministic"])
 
     _logits, _targets = [], []
 
     model.eval()
 
-    running_loss = 0.0
+    running_loss = torch.zeros((), device=device)
     with torch.no_grad():
         for batch in dataloader:
             data = batch["data"].to(device)
             labels = batch["labels"].to(device)
 
-            attention_mask = torch.clone(data != 0)
+            attention_mask = (data != 0)
             probs = model(data, attention_mask=attention_mask)
             if isinstance(probs, tuple):
                 probs = probs[0]
-            cls_probs = get_token_logits(device, data, probs, tokenizer.cls_token_id)
+            cls_probs = get_token_logits(data, probs, tokenizer.cls_token_id)
 
             loss = loss_fn(cls_probs, labels)
-            running_loss += loss.item()
+            running_loss += loss.detach()
 
-            _logits.append(cls_probs.argmax(1).cpu().detach().numpy().tolist())
-            _targets.append(labels.cpu().detach().numpy().tolist())
+            _logits.append(cls_probs.argmax(1).detach())
+            _targets.append(labels.detach())
 
     return {
-        "loss": running_loss / batch_size,
-        "metrics": metric_fn(_logits, _targets, num_labels)
+        "loss": (running_loss / len(dataloader)).item(),
+        "metrics": metric_fn(torch.cat(_logits), torch.cat(_targets), num_labels)
     }
 
 
 if __name__ == "__main__":
     conf = Config()
-    tokenizer = BertTokenizer.from_pretrained(conf["pretrained_model_name"])
+    tokenizer = BertTokenizerFast.from_pretrained(conf["pretrained_model_name"])
 
     dataset_type = get_dataset_type(conf["table_serialization_type"])
 
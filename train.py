@@ -1,25 +1,30 @@
 import pandas as pd
 import torch
+import torch.distributed as dist
 
 from dataset.dataloader import CtaDataLoader
 
 from logs.logger import Logger
 
-from model.metric import multiple_f1_score
+from model.metric import MultipleF1Score
 from model.model import BertForClassification
 
-from transformers import BertTokenizer, BertConfig, get_linear_schedule_with_warmup
+from transformers import BertTokenizerFast, BertConfig, get_linear_schedule_with_warmup
 
 from config import Config
 from trainer.trainer import Trainer
-from utils.functions import prepare_device, collate, plot_graphs, set_rs, get_dataset_type
+from utils.functions import prepare_device, collate, plot_graphs, set_rs, get_dataset_type, prepare_distributed, \
+    is_main_process
 
 
 def train(config: Config):
-    set_rs(config["random_seed"])
+    set_rs(config["random_seed"], config["deterministic"])
+
+    # Launched with `torchrun`, every process trains on its own GPU.
+    local_rank = prepare_distributed()
 
     # TODO: assert config variables assigned and correct
-    tokenizer = BertTokenizer.from_pretrained(config["pretrained_model_name"])
+    tokenizer = BertTokenizerFast.from_pretrained(config["pretrained_model_name"])
 
     dataset_type = get_dataset_type(config["table_serialization_type"])
     dataset = dataset_type(
@@ -32,26 +37,61 @@ def train(config: Config):
         batch_size=config["batch_size"],
         num_workers=config["dataloader"]["num_workers"],
         split=config["dataloader"]["valid_split"],
-        collate_fn=collate
+        collate_fn=collate,
+        pin_memory=config["dataloader"]["pin_memory"],
+        persistent_workers=config["dataloader"]["persistent_workers"],
+        prefetch_factor=config["dataloader"]["prefetch_factor"],
+        distributed=local_rank is not None,
+        bucket_by_length=config["dataloader"]["bucket_by_length"],
+        num_buckets=config["dataloader"]["num_buckets"],
+        seed=config["random_seed"]
     )
     valid_dataloader = train_dataloader.get_valid_dataloader()
 
     model = BertForClassification(
         BertConfig.from_pretrained(config["pretrained_model_name"], num_labels=config["num_labels"])
     )
-
-    device, device_ids = prepare_device(config["num_gpu"])
+    if config["gradient_checkpointing"]:
+        # Non-reentrant checkpointing is compatible with DistributedDataParallel.
+        model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+
+    if local_rank is not None:
+        device = torch.device(f"cuda:{local_rank}")
+    else:
+        if config["num_gpu"] > 1:
+            print("Warning: Multiple GPU training requires launch with `torchrun`, training will be performed on 1 GPU.")
+        device, _ = prepare_device(min(config["num_gpu"], 1))
     model = model.to(device)
-    if len(device_ids) > 1:
-        model = torch.nn.DataParallel(model, device_ids=device_ids)
-
-    optimizer = torch.optim.AdamW(model.parameters(), lr=5e-5, eps=1e-8)
+    if local_rank is not None:
+        # Model graph is the same every iteration: DDP records the backward order once, which also
+        # handles pooler parameters without gradients (pooler output is not used in classification).
+        # Gradients are views into all-reduce buckets, so they are not copied every step.
+        model = torch.nn.parallel.DistributedDataParallel(
+            model,
+            device_ids=[local_rank],
+            bucket_cap_mb=50,
+            static_graph=True,
+            gradient_as_bucket_view=True
+        )
+    if config["compile_model"]:
+        # Sequence length varies by batch, so the model is compiled with dynamic shapes.
+        # CUDA graphs are recorded per shape, so they are disabled.
+        model = torch.compile(model, mode="max-autotune-no-cudagraphs", dynamic=True)
+
+    # Fused implementation updates all parameters in a single kernel, supported only on CUDA.
+    optimizer = torch.optim.AdamW(
+        model.parameters(),
+        lr=5e-5,
+        eps=1e-8,
+        fused=device.type == "cuda",
+        foreach=device.type != "cuda"
+    )
     trainer = Trainer(
         model,
         tokenizer,
         config["num_labels"],
         torch.nn.CrossEntropyLoss(),
-        multiple_f1_score,
+        MultipleF1Score(config["num_labels"], device=device),
         optimizer,
         config,
         device,
@@ -64,7 +104,7 @@ def train(config: Config):
             num_training_steps=len(train_dataloader) * config["num_epochs"]
         ),
         num_epochs=config["num_epochs"],
-        logger=Logger(filename=config["train_log_filename"])
+        logger=Logger(filename=config["train_log_filename"], enabled=is_main_process())
     )
     return trainer.train()
 
@@ -78,12 +118,16 @@ if __name__ == "__main__":
 
     # plot_graphs(losses, metrics, conf)
 
-    results["train_loss"] = losses["train"]
-    results["valid_loss"] = losses["valid"]
+    if is_main_process():
+        results["train_loss"] = losses["train"]
+        results["valid_loss"] = losses["valid"]
+
+        for metric in conf["metrics"]:
+            tr_f1, vl_f1 = metrics["train"][metric], metrics["valid"][metric]
+            results[f"train-{metric}"] = tr_f1
+            results[f"valid-{metric}"] = vl_f1
 
-    for metric in conf["metrics"]:
-        tr_f1, vl_f1 = metrics["train"][metric], metrics["valid"][metric]
-        results[f"train-{metric}"] = tr_f1
-        results[f"valid-{metric}"] = vl_f1
+        results.to_csv(conf["logs_dir"] + "training_results.csv", index=False)
 
-    results.to_csv(conf["logs_dir"] + "training_results.csv", index=False)
+    if dist.is_initialized():
+        dist.destroy_process_group()
@@ -1,16 +1,23 @@
 from typing import Optional, Callable, Any
 
+import contextlib
+import copy
+import threading
+
 import torch
+import torch.distributed as dist
 from torch.optim import Optimizer
 from torch.utils.data import DataLoader
 
-from transformers import BertPreTrainedModel, BertTokenizer
+from transformers import BertPreTrainedModel, BertTokenizerFast
 
 from datetime import datetime
 
 from config import Config
+from dataset.dataloader import CtaDataLoader
 from logs.logger import Logger
-from utils.functions import get_token_logits, get_map_location
+from model.metric import MultipleF1Score
+from utils.functions import get_token_logits, is_main_process, to_cpu, unwrap_model, filter_model_state_dict
 
 
 class Trainer:
@@ -18,12 +25,16 @@ class Trainer:
 
     Encapsulates training / validating logic, saving and loading from checkpoints.
 
+    Note:
+        Supports distributed training, losses and metrics are reduced between all processes,
+        checkpoints are saved only by the main process.
+
     Args:
         model: Training model.
         tokenizer: BERT tokenizer.
         num_labels: Total number of labels.
         loss_fn: Loss function.
-        metric_fn: Classification metric function.
+        metric: Stateful classification metric, accumulated by batch.
         optimizer: GD optimizer.
         config: Training configuration.
         device: Torch device.
@@ -37,10 +48,10 @@ class Trainer:
     def __init__(
             self,
             model: BertPreTrainedModel,
-            tokenizer: BertTokenizer,
+            tokenizer: BertTokenizerFast,
             num_labels: int,
             loss_fn: Callable,
-            metric_fn: Callable,
+            metric: MultipleF1Score,
             optimizer: Optimizer,
             config: Config,
             device: torch.device,
@@ -53,9 +64,10 @@ class Trainer:
     ):
         self.model = model
         self.tokenizer = tokenizer
+        self.cls_token_id = int(tokenizer.cls_token_id)
         self.num_labels = num_labels
         self.loss_fn = loss_fn
-        self.metric_fn = metric_fn
+        self.metric = metric
         self.optimizer = optimizer
 
         self.num_epochs = num_epochs
@@ -68,12 +80,22 @@ class Trainer:
         self.train_dataloader = train_dataloader
         self.valid_dataloader = valid_dataloader
         self.batch_size = batch_size
+        self.accumulation_steps = config["gradient_accumulation_steps"]
 
         self.logger = logger
         self.logger.info("--- New trainer initialized ---", "TRAINER")
 
         self.lr_scheduler = lr_scheduler
 
+        # Mixed precision: bf16 if supported by GPU, otherwise fp16 with loss scaling.
+        self.use_amp = config["mixed_precision"] and self.device.type == "cuda"
+        self.autocast_dtype = (
+            torch.bfloat16 if self.use_amp and torch.cuda.is_bf16_supported() else torch.float16
+        )
+        self.scaler = torch.cuda.amp.GradScaler(
+            enabled=self.use_amp and self.autocast_dtype == torch.float16
+        )
+
         for metric_name in config["metrics"]:
             setattr(self, f"best_{metric_name}", 0.0)
         self.metrics = {
@@ -87,6 +109,7 @@ class Trainer:
         }
 
         self.checkpoint_dir = config["checkpoint_dir"]
+        self._save_thread = None
         if config["start_from_checkpoint"]:
             self._load_checkpoint(self.checkpoint_dir + config["checkpoint_name"])
 
@@ -98,6 +121,8 @@ class Trainer:
         """
         for epoch in range(self.start_epoch, self.num_epochs):
             self.logger.info(f"Epoch {epoch} started.", "EPOCH")
+            if isinstance(self.train_dataloader, CtaDataLoader):
+                self.train_dataloader.set_epoch(epoch)
 
             train_loss_metric = self._train_epoch()
             self.losses["train"].append(train_loss_metric["loss"])
@@ -141,7 +166,8 @@ class Trainer:
                     )
 
             if epoch % self.save_period_in_epochs == 0:
-                Logger.nvidia_smi()
+                if is_main_process():
+                    Logger.nvidia_smi()
 
                 self._save_checkpoint(
                     epoch,
@@ -154,45 +180,62 @@ class Trainer:
                     "PERIODIC_SAVED"
                 )
             self.logger.info("--- --- ---", "TRAINER")
+        self._wait_checkpoint_saved()
         self.logger.info(f"Training successfully ended.", "TRAINER")
         return self.losses, self.metrics
 
     def _train_epoch(self) -> dict:
         """Train epoch.
 
+        Note:
+            Gradients are averaged over `gradient_accumulation_steps` batches (or less, for the last
+            batches of the epoch) before optimizer step.
+            In distributed mode gradients are synchronized between processes only on optimizer step.
+
         Returns:
             dict: Dictionary of training epoch loss and metrics.
         """
-        _logits, _targets = [], []
+        self.metric.reset()
 
         self.model.train()
 
-        running_loss = 0.0
-        for batch in self.train_dataloader:
-            data = batch["data"].to(self.device)
-            labels = batch["labels"].to(self.device)
+        num_batches = len(self.train_dataloader)
+        running_loss = torch.zeros((), device=self.device)
+        for i, batch in enumerate(self.train_dataloader):
+            data = batch["data"].to(self.device, non_blocking=True)
+            labels = batch["labels"].to(self.device, non_blocking=True)
+
+            is_optimizer_step = (i + 1) % self.accumulation_steps == 0 or i + 1 == num_batches
+            # Last accumulation window of the epoch may be incomplete.
+            window_start = i - i % self.accumulation_steps
+            window_size = min(self.accumulation_steps, num_batches - window_start)
+            # DistributedDataParallel skips gradients all-reduce within `no_sync`.
+            sync_context = (
+                self.model.no_sync() if not is_optimizer_step and hasattr(self.model, "no_sync")
+                else contextlib.nullcontext()
+            )
 
-            attention_mask = torch.clone(data != 0)
-            logits, = self.model(data, attention_mask=attention_mask)
-            cls_logits = get_token_logits(self.device, data, logits, self.tokenizer.cls_token_id)
+            attention_mask = (data != 0)
+            with sync_context:
+                with torch.autocast(device_type=self.device.type, dtype=self.autocast_dtype, enabled=self.use_amp):
+                    logits, = self.model(data, attention_mask=attention_mask)
+                    cls_logits = get_token_logits(data, logits, self.cls_token_id)
 
-            loss = self.loss_fn(cls_logits, labels)
-            running_loss += loss.item()
-            loss.backward()
+                    loss = self.loss_fn(cls_logits, labels)
+                self.scaler.scale(loss / window_size).backward()
+            running_loss += loss.detach()
 
-            self.optimizer.step()
-            # model.zero_grad with set_to_none is more efficient
-            self.model.zero_grad(set_to_none=True)
+            if is_optimizer_step:
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+                # model.zero_grad with set_to_none is more efficient
+                self.model.zero_grad(set_to_none=True)
 
-            _logits.append(cls_logits.argmax(1).cpu().detach().numpy().tolist())
-            _targets.append(labels.cpu().detach().numpy().tolist())
+            self.metric.update(cls_logits.argmax(1), labels)
 
         if self.lr_scheduler is not None:
             self.lr_scheduler.step()
-        return {
-            "loss": running_loss / self.batch_size,
-            "metrics": self.metric_fn(_logits, _targets, self.num_labels)
-        }
+        return self._get_epoch_result(running_loss, num_batches)
 
     def _validate_epoch(self) -> dict:
         """Validate epoch.
@@ -200,32 +243,54 @@ class Trainer:
         Returns:
             dict: Dictionary of validation epoch loss and metrics.
         """
-        _logits, _targets = [], []
+        self.metric.reset()
 
         self.model.eval()
 
-        running_loss = 0.0
+        running_loss = torch.zeros((), device=self.device)
         with torch.no_grad():
             for batch in self.valid_dataloader:
-                data = batch["data"].to(self.device)
-                labels = batch["labels"].to(self.device)
+                data = batch["data"].to(self.device, non_blocking=True)
+                labels = batch["labels"].to(self.device, non_blocking=True)
+
+                attention_mask = (data != 0)
+                with torch.autocast(device_type=self.device.type, dtype=self.autocast_dtype, enabled=self.use_amp):
+                    probs = self.model(data, attention_mask=attention_mask)
+                    # TODO: why it can return tuple(tensor), except for just tensor?
+                    if isinstance(probs, tuple):
+                        probs = probs[0]
+                    cls_probs = get_token_logits(data, probs, self.cls_token_id)
+
+                    loss = self.loss_fn(cls_probs, labels)
+                running_loss += loss.detach()
+
+                self.metric.update(cls_probs.argmax(1), labels)
+
+        return self._get_epoch_result(running_loss, len(self.valid_dataloader))
 
-                attention_mask = torch.clone(data != 0)
-                probs = self.model(data, attention_mask=attention_mask)
-                # TODO: why it can return tuple(tensor), except for just tensor?
-                if isinstance(probs, tuple):
-                    probs = probs[0]
-                cls_probs = get_token_logits(self.device, data, probs, self.tokenizer.cls_token_id)
+    def _get_epoch_result(self, running_loss: torch.Tensor, num_batches: int) -> dict:
+        """Calculate epoch loss and metrics.
 
-                loss = self.loss_fn(cls_probs, labels)
-                running_loss += loss.item()
+        In distributed mode loss is averaged and metric states are synchronized between all processes,
+        so every process gets the same result.
 
-                _logits.append(cls_probs.argmax(1).cpu().detach().numpy().tolist())
-                _targets.append(labels.cpu().detach().numpy().tolist())
+        Note:
+            Loss is accumulated on device, so host is synchronized once per epoch.
+
+        Args:
+            running_loss: Sum of batch losses of current process.
+            num_batches: Number of batches in epoch of current process.
+
+        Returns:
+            dict: Dictionary of epoch loss and metrics.
+        """
+        loss = running_loss / num_batches
+        if dist.is_initialized():
+            dist.all_reduce(loss, op=dist.ReduceOp.AVG)
 
         return {
-            "loss": running_loss / self.batch_size,
-            "metrics": self.metric_fn(_logits, _targets, self.num_labels)
+            "loss": loss.item(),
+            "metrics": self.metric.compute()
         }
 
     def _save_checkpoint(
@@ -238,12 +303,17 @@ class Trainer:
     ) -> None:
         """Save model checkpoint.
 
-        Model is saved in `checkpoints` directory.
+        Model is saved in `checkpoints` directory. In distributed mode only the main process saves checkpoints.
+
+        Note:
+            Checkpoint is copied to CPU and then written to disk in a background thread, so training
+            continues during disk I/O. Only one checkpoint is written at a time.
 
         Parameters to be saved:
             - number of epoch
             - model state dict
             - optimizer state dict
+            - gradient scaler state dict
             - train/validation losses
             - train/validation metrics
             - current best metrics values
@@ -258,6 +328,9 @@ class Trainer:
         Returns:
             None
         """
+        if not is_main_process():
+            return
+
         if save_best:
             checkpoint_path = (
                 f"{self.checkpoint_dir}model_best_{suffix}.pt"
@@ -267,17 +340,30 @@ class Trainer:
                 f"{self.checkpoint_dir}model_epoch_{epoch}_"
                 f"datetime-{datetime.now():%d-%m-%y_%H-%M-%S}.pt"
             )
-        torch.save(
-            {
-                "epoch": epoch,
-                "model_state_dict": self.model.state_dict(),
-                "optimizer_state_dict": self.optimizer.state_dict(),
-                "losses": losses,
-                "metrics": metrics,
-                "best_metrics": {f"best_{i}": getattr(self, f"best_{i}") for i in self.config["metrics"]},
-            },
-            checkpoint_path
-        )
+        checkpoint = to_cpu({
+            "epoch": epoch,
+            # Unwrapped state dict keys do not depend on torch.compile / DDP settings.
+            "model_state_dict": unwrap_model(self.model).state_dict(),
+            "optimizer_state_dict": self.optimizer.state_dict(),
+            "scaler_state_dict": self.scaler.state_dict(),
+            "losses": copy.deepcopy(losses),
+            "metrics": copy.deepcopy(metrics),
+            "best_metrics": {f"best_{i}": getattr(self, f"best_{i}") for i in self.config["metrics"]},
+        })
+
+        self._wait_checkpoint_saved()
+        self._save_thread = threading.Thread(target=torch.save, args=(checkpoint, checkpoint_path))
+        self._save_thread.start()
+
+    def _wait_checkpoint_saved(self) -> None:
+        """Wait until checkpoint, saving in background, is written to disk.
+
+        Returns:
+            None
+        """
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
 
     def _load_checkpoint(self, checkpoint_path: str) -> None:
         """Load model checkpoint.
@@ -290,12 +376,17 @@ class Trainer:
         Returns:
             None
         """
-        checkpoint = torch.load(checkpoint_path, map_location=get_map_location())
+        # Tensors are loaded directly on the training device.
+        checkpoint = torch.load(checkpoint_path, map_location=self.device)
 
         self.start_epoch = checkpoint["epoch"] + 1
 
-        self.model.load_state_dict(checkpoint["model_state_dict"])
+        # Checkpoints saved from wrapped models have prefixed keys.
+        unwrap_model(self.model).load_state_dict(filter_model_state_dict(checkpoint["model_state_dict"]))
         self.optimizer.load_state_dict(checkpoint["optimizer_state_dict"])
+        # Checkpoints saved before mixed precision support have no scaler state.
+        if "scaler_state_dict" in checkpoint:
+            self.scaler.load_state_dict(checkpoint["scaler_state_dict"])
 
         for metric_name in self.config["metrics"]:
             setattr(self, f"best_{metric_name}", checkpoint["best_metrics"][f"best_{metric_name}"])
@@ -1,9 +1,12 @@
-from typing import Optional, Type
+from typing import Any, Optional, Type
 
 from collections import OrderedDict
 
+import os
+
 import numpy as np
 import torch
+import torch.distributed as dist
 
 import matplotlib.pyplot as plt
 
@@ -20,18 +23,22 @@ def collate(samples: list) -> dict:
 
     Flatten labels into one sequence.
 
+    Note:
+        Sequences are copied into a preallocated (batch_size, max_length) tensor, so the batch is contiguous.
+
     Args:
         samples: Samples from batch.
 
     Returns:
         dict: Padded sequences and flattened labels.
     """
-    data = torch.nn.utils.rnn.pad_sequence(
-        [sample["data"] for sample in samples]
-    )
+    lengths = [sample["data"].size(0) for sample in samples]
+    data = torch.zeros(len(samples), max(lengths), dtype=samples[0]["data"].dtype)
+    for i, sample in enumerate(samples):
+        data[i, :lengths[i]] = sample["data"]
     labels = torch.cat([sample["labels"] for sample in samples])
 
-    batch = {"data": data.T, "labels": labels}
+    batch = {"data": data, "labels": labels}
     return batch
 
 
@@ -59,11 +66,39 @@ def prepare_device(n_gpu_use: int) -> tuple[torch.device, list]:
     return device, list_ids
 
 
-def get_token_logits(device: torch.device, data: torch.Tensor, logits: torch.Tensor, token_id: int) -> torch.Tensor:
+def prepare_distributed() -> Optional[int]:
+    """Initialize distributed process group.
+
+    Note:
+        Process group is initialized only if the script was launched with `torchrun`, which sets
+        `LOCAL_RANK` and `WORLD_SIZE` environment variables.
+
+    Returns:
+        Optional[int]: Local rank of the process (index of its GPU), None if not launched in distributed mode.
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return None
+    local_rank = int(os.environ["LOCAL_RANK"])
+    torch.cuda.set_device(local_rank)
+    dist.init_process_group(backend="nccl")
+    return local_rank
+
+
+def is_main_process() -> bool:
+    """Check if current process is the main one.
+
+    Returns:
+        bool: True if distributed is not initialized or process has rank 0.
+    """
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def get_token_logits(data: torch.Tensor, logits: torch.Tensor, token_id: int) -> torch.Tensor:
     """Get specific token logits in the data.
 
+    Logits are gathered by a single advanced indexing operation, in row-major order of token positions.
+
     Args:
-        device: Device (GPU or CPU).
         data: Model input data.
         logits: Model logits.
         token_id: Token id.
@@ -71,17 +106,8 @@ def get_token_logits(device: torch.device, data: torch.Tensor, logits: torch.Ten
     Returns:
         torch.Tensor: All specific token logits in data.
     """
-    token_indexes = torch.nonzero(data == token_id)
-    token_logits = torch.zeros(
-        token_indexes.shape[0],
-        logits.shape[2]
-    ).to(device)
-
-    for i in range(token_indexes.shape[0]):
-        j, k = token_indexes[i]
-        logit_i = logits[j, k, :]
-        token_logits[i] = logit_i
-    return token_logits
+    rows, cols = (data == token_id).nonzero(as_tuple=True)
+    return logits[rows, cols, :]
 
 
 def plot_graphs(losses: dict, metrics: dict, config: Config) -> None:
@@ -110,21 +136,29 @@ def plot_graphs(losses: dict, metrics: dict, config: Config) -> None:
         plt.show()
 
 
-def set_rs(seed: int = 13) -> None:
+def set_rs(seed: int = 13, deterministic: bool = False) -> None:
     """Set random seed.
 
+    Note:
+        Deterministic mode forces cuDNN to use deterministic algorithms and disables TF32 matmuls,
+        which slows down training. Otherwise cuDNN benchmarks and caches the fastest algorithms.
+
     Args:
         seed: Random seed.
+        deterministic: Flag to make GPU computations reproducible.
 
     Returns:
         None
     """
     # Random seed
     torch.manual_seed(seed)
-    torch.backends.cudnn.deterministic = True
-    torch.backends.cudnn.benchmark = False
     np.random.seed(seed)
 
+    torch.backends.cudnn.deterministic = deterministic
+    torch.backends.cudnn.benchmark = not deterministic
+    torch.backends.cuda.matmul.allow_tf32 = not deterministic
+    torch.backends.cudnn.allow_tf32 = not deterministic
+
 
 def get_map_location() -> Optional[torch.device]:
     """Get device to perform model loading.
@@ -138,23 +172,70 @@ def get_map_location() -> Optional[torch.device]:
     return map_location
 
 
+def to_cpu(obj: Any) -> Any:
+    """Copy tensors to CPU.
+
+    Recursively copies tensors in nested dictionaries, lists and tuples (e.g. model and optimizer state dicts).
+
+    Args:
+        obj: Tensor or container of tensors.
+
+    Returns:
+        Any: Object of the same structure with tensors on CPU, other values are returned as is.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        copied = type(obj)((k, to_cpu(v)) for k, v in obj.items())
+        # Model state dicts store module versions in metadata, used while loading.
+        if hasattr(obj, "_metadata"):
+            copied._metadata = obj._metadata
+        return copied
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def unwrap_model(model: torch.nn.Module) -> torch.nn.Module:
+    """Get original model from wrappers.
+
+    Unwraps models, wrapped by torch.compile and torch.DataParallel / DistributedDataParallel.
+
+    Args:
+        model: PyTorch model, possibly wrapped.
+
+    Returns:
+        torch.nn.Module: Original model.
+    """
+    while True:
+        if hasattr(model, "_orig_mod"):
+            model = model._orig_mod
+        elif isinstance(model, (torch.nn.DataParallel, torch.nn.parallel.DistributedDataParallel)):
+            model = model.module
+        else:
+            return model
+
+
 def filter_model_state_dict(model_state_dict: dict) -> OrderedDict:
     """Filter model state dict keys.
 
-    Filters model state dict keys after training with torch.DataParallel on multiple GPUs.
+    Filters model state dict keys after training with torch.DataParallel / DistributedDataParallel on multiple GPUs
+    and with torch.compile.
 
     Args:
         model_state_dict: PyTorch model state dictionary.
 
     Returns:
-        OrderedDict: model state dict without `model` in keys, inserted by torch.DataParallel
+        OrderedDict: model state dict without `module.` and `_orig_mod.` in keys, inserted by
+            torch.DataParallel / DistributedDataParallel and torch.compile.
     """
+    prefixes = ("module.", "_orig_mod.")
+
     filtered_model_state_dict = OrderedDict()
     for k, v in model_state_dict.items():
-        if k.startswith("module."):
-            filtered_model_state_dict[k[7:]] = v
-        else:
-            filtered_model_state_dict[k] = v
+        while k.startswith(prefixes):
+            k = k.split(".", 1)[1]
+        filtered_model_state_dict[k] = v
     return filtered_model_state_dict
 
 